@@ -198,8 +198,8 @@ def example_4_verify_against_original():
     
     # Test S-curve calculation
     energies, s_exp = config.get_your_experimental_data()
-    d_ox, s_ox = fit_experimental_data(energies, s_exp)['thickness_nm'], \
-                 fit_experimental_data(energies, s_exp)['s_oxide']
+    fit_results = fit_experimental_data(energies, s_exp)
+    d_ox, s_ox = fit_results['thickness_nm'], fit_results['s_oxide']
     
     print(f"\nFitted thickness: {d_ox:.2f} nm")
     print(f"This should match YOUR result from pals-solver.ipynb Cell 2")
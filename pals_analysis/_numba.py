@@ -0,0 +1,45 @@
+"""Optional Numba support shared by the compiled kernels."""
+
+import functools
+import threading
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:
+    # Numba is optional, without it every caller keeps its NumPy/SciPy path.
+    njit = None
+    prange = range
+
+HAVE_NUMBA = njit is not None
+
+# The workqueue threading layer (Numba's fallback when neither TBB nor OpenMP
+# is installed) aborts the process if two threads run parallel kernels at
+# once. Kernels then take this lock; under TBB/OpenMP they run concurrently.
+# The layer is only known after the first parallel call, so calls are
+# serialized until then.
+_kernel_lock = threading.Lock()
+_serialize = None
+
+
+def jit_kernel(func):
+    """
+    Compiles func as a parallel kernel (prange loops, no GIL) when Numba is
+    installed, and returns it unchanged otherwise. The compiled kernel is
+    safe to call from several Python threads on every threading layer.
+    """
+    if njit is None:
+        return func
+    kernel = njit(fastmath=True, cache=True, parallel=True, nogil=True)(func)
+
+    @functools.wraps(func)
+    def call(*args):
+        global _serialize
+        if _serialize is False:
+            return kernel(*args)
+        with _kernel_lock:
+            result = kernel(*args)
+            _serialize = numba.threading_layer() == 'workqueue'
+        return result
+
+    return call
@@ -14,7 +14,8 @@ from .sensitivity import (
 __all__ = [
     'theoretical_S_curve', 
     'solve_for_thickness', 
-    'fit_model',
+    'numerical_S_curve',
+    'solve_graded_model',
     'study_interface_width',
     'study_diffusion_length',
     'study_layer_thickness',
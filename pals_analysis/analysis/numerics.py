@@ -0,0 +1,18 @@
+"""Numerical helpers shared by the analysis modules."""
+
+import numpy as np
+
+
+def trapezoid_weights(z_grid):
+    """
+    Trapezoid weights B for the (sorted) grid z_grid, such that
+    Integral( f(z) dz ) = 0.5 * f @ B.
+
+    B_i = z_{i+1} - z_{i-1}; the two endpoints only have one neighbour.
+    """
+    z_grid = np.asarray(z_grid, dtype=float)
+    B = np.empty(len(z_grid))
+    B[1:-1] = z_grid[2:] - z_grid[:-2]
+    B[0] = z_grid[1] - z_grid[0]
+    B[-1] = z_grid[-1] - z_grid[-2]
+    return B
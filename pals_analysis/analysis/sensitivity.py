@@ -1,12 +1,32 @@
 """Sensitivity analysis and parameter studies."""
 
+from dataclasses import replace
+
 import numpy as np
+from scipy.special import expit
+from ..physics.layers import as_layers
 from ..physics.implantation import makhov_profile
 from ..physics.annihilation import calculate_annihilation_profile
-from .thickness_solver import solve_for_thickness
+from .numerics import trapezoid_weights
+from .thickness_solver import solve_for_thickness, fit_theoretical_batch
+
+
+# Default depth grid of the studies (nm) and its trapezoid weights, built once.
+_Z_DEFAULT = np.linspace(0, 600, 300)
+_Z_DEFAULT.setflags(write=False)
+_B_DEFAULT = trapezoid_weights(_Z_DEFAULT)
+_B_DEFAULT.setflags(write=False)
+
 
+def _grid_and_weights(z):
+    """Returns the depth grid and its trapezoid weights (default if z is None)."""
+    if z is None:
+        return _Z_DEFAULT, _B_DEFAULT
+    z = np.asarray(z, dtype=float)
+    return z, trapezoid_weights(z)
 
-def study_interface_width(energies, s_exp, base_layers, width_values):
+
+def study_interface_width(energies, s_exp, base_layers, width_values, z=None):
     """
     Study effect of interface width on fitted thickness.
     
@@ -16,10 +36,12 @@ def study_interface_width(energies, s_exp, base_layers, width_values):
         Experimental energies
     s_exp : array
         Experimental S-parameters
-    base_layers : list
+    base_layers : Layers or list
         Base layer configuration
     width_values : array
         Interface widths to test (nm)
+    z : array, optional
+        Depth grid (nm), default 300 points over 0-600 nm
     
     Returns
     -------
@@ -34,23 +56,22 @@ def study_interface_width(energies, s_exp, base_layers, width_values):
         's_surfaces': []
     }
     
+    z, B = _grid_and_weights(z)
+    base_layers = as_layers(base_layers)
+    d_ox = base_layers.thickness[0]
+
+    # The interface width only enters through S(z): implantation and
+    # diffusion are the same for every width, so they are computed once.
+    p_z = makhov_profile(z, np.asarray(energies), base_layers)
+    c_z = calculate_annihilation_profile(z, p_z, base_layers)
+    
     for w in width_values:
-        # Simulate with graded interface
-        z = np.linspace(0, 600, 300)
-        s_curves = []
-        
-        for e in energies:
-            p_z = makhov_profile(z, e, base_layers)
-            c_z = calculate_annihilation_profile(z, p_z, base_layers)
-            
-            # Graded S(z) profile
-            d_ox = base_layers[0]['thickness']
-            s_z = 0.52 + (0.575 - 0.52) / (1 + np.exp((z - d_ox) / (w/4)))
-            s_val = np.trapezoid(c_z * s_z, z)
-            s_curves.append(s_val)
+        # Simulate with graded interface S(z) profile
+        s_z = 0.52 + (0.575 - 0.52) * expit(-(z - d_ox) * (4.0 / w))
+        s_curves = c_z @ (0.5 * B * s_z)
         
         # Fit the simulated data
-        d_fit, s_fit = solve_for_thickness(energies, np.array(s_curves))
+        d_fit, s_fit = solve_for_thickness(energies, s_curves)
         results['thicknesses'].append(d_fit)
         results['s_surfaces'].append(s_fit)
     
@@ -60,7 +81,7 @@ def study_interface_width(energies, s_exp, base_layers, width_values):
     return results
 
 
-def study_diffusion_length(energy, base_layers, L_values, z_max=600):
+def study_diffusion_length(energy, base_layers, L_values, z_max=600, z=None):
     """
     Study effect of diffusion length on annihilation profile.
     
@@ -68,36 +89,39 @@ def study_diffusion_length(energy, base_layers, L_values, z_max=600):
     ----------
     energy : float
         Beam energy (keV)
-    base_layers : list
+    base_layers : Layers or list
         Base layer configuration
     L_values : array
         Diffusion lengths to test (nm)
     z_max : float
-        Maximum depth (nm)
+        Maximum depth (nm), used when z is not given
+    z : array, optional
+        Depth grid (nm), default 300 points over 0-z_max
     
     Returns
     -------
     dict
         Results containing profiles for each L value
     """
-    z = np.linspace(0, z_max, 300)
+    if z is None and z_max == 600:
+        z = _Z_DEFAULT
+    elif z is None:
+        z = np.linspace(0, z_max, 300)
     
     results = {
-        'z': z,
+        # The default grid is shared and read-only, so the caller gets a copy.
+        'z': _Z_DEFAULT.copy() if z is _Z_DEFAULT else z,
         'L_values': L_values,
         'profiles': []
     }
     
     # Calculate implantation once
+    base_layers = as_layers(base_layers)
     p_z = makhov_profile(z, energy, base_layers)
     
     for L in L_values:
-        # Modify diffusion length
-        layers_modified = []
-        for layer in base_layers:
-            layer_copy = layer.copy()
-            layer_copy['L_diff'] = L
-            layers_modified.append(layer_copy)
+        # Modify diffusion length (in every layer)
+        layers_modified = replace(base_layers, L_diff=np.full_like(base_layers.L_diff, L))
         
         c_z = calculate_annihilation_profile(z, p_z, layers_modified)
         results['profiles'].append(c_z)
@@ -107,7 +131,7 @@ def study_diffusion_length(energy, base_layers, L_values, z_max=600):
     return results
 
 
-def study_layer_thickness(energies, thickness_values, base_layers):
+def study_layer_thickness(energies, thickness_values, base_layers, z=None):
     """
     Study effect of oxide thickness on S-parameter curve.
     
@@ -117,8 +141,10 @@ def study_layer_thickness(energies, thickness_values, base_layers):
         Energy values (keV)
     thickness_values : array
         Oxide thicknesses to test (nm)
-    base_layers : list
-        Base layer configuration
+    base_layers : Layers or list
+        Base layer configuration (not modified)
+    z : array, optional
+        Depth grid (nm), default 300 points over 0-600 nm
     
     Returns
     -------
@@ -131,31 +157,34 @@ def study_layer_thickness(energies, thickness_values, base_layers):
         's_curves': []
     }
     
-    z = np.linspace(0, 600, 300)
+    z, B = _grid_and_weights(z)
+    base_layers = as_layers(base_layers)
+    
+    # Repeated thicknesses are only simulated once.
+    s_curve_by_thickness = {}
     
     for d_ox in thickness_values:
-        # Modify thickness
-        layers_modified = base_layers.copy()
-        layers_modified[0]['thickness'] = d_ox
-        
-        s_curve = []
-        for e in energies:
-            p_z = makhov_profile(z, e, layers_modified)
+        if d_ox not in s_curve_by_thickness:
+            # Modify thickness on a new stack; base_layers stays untouched
+            thickness = base_layers.thickness.copy()
+            thickness[0] = d_ox
+            layers_modified = replace(base_layers, thickness=thickness)
+            
+            p_z = makhov_profile(z, np.asarray(energies), layers_modified)
             c_z = calculate_annihilation_profile(z, p_z, layers_modified)
             
             # Sharp interface S(z)
             s_z = np.where(z <= d_ox, 0.575, 0.52)
-            s_val = np.trapezoid(c_z * s_z, z)
-            s_curve.append(s_val)
+            s_curve_by_thickness[d_ox] = c_z @ (0.5 * B * s_z)
         
-        results['s_curves'].append(s_curve)
+        results['s_curves'].append(s_curve_by_thickness[d_ox])
     
     results['s_curves'] = np.array(results['s_curves'])
     
     return results
 
 
-def monte_carlo_uncertainty(energies, s_exp, s_err, n_iterations=1000):
+def monte_carlo_uncertainty(energies, s_exp, s_err, n_iterations=1000, seed=None):
     """
     Estimate uncertainty using Monte Carlo sampling.
     
@@ -169,28 +198,28 @@ def monte_carlo_uncertainty(energies, s_exp, s_err, n_iterations=1000):
         Uncertainties in S-parameters
     n_iterations : int
         Number of Monte Carlo samples
+    seed : int or numpy.random.Generator, optional
+        Seed (or generator) for the noise, for reproducible results
     
     Returns
     -------
     dict
-        Results with distributions of fitted parameters
+        Results with distributions of fitted parameters and the number of
+        failed fits ('n_failed')
     """
-    thicknesses = []
-    s_surfaces = []
-    
-    for i in range(n_iterations):
-        # Add noise to data
-        s_sample = s_exp + np.random.normal(0, s_err)
-        
-        try:
-            d_fit, s_fit = solve_for_thickness(energies, s_sample)
-            thicknesses.append(d_fit)
-            s_surfaces.append(s_fit)
-        except:
-            continue  # Skip failed fits
-    
-    thicknesses = np.array(thicknesses)
-    s_surfaces = np.array(s_surfaces)
+    # Add noise to data, one row per Monte Carlo sample. The whole noise
+    # block is drawn in one call.
+    s_exp = np.asarray(s_exp, dtype=float)
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal((n_iterations, len(s_exp))) * s_err
+    s_samples = s_exp + noise
+    
+    # All samples are fitted together; failed fits come back as NaN and
+    # are skipped
+    params = fit_theoretical_batch(energies, s_samples)
+    ok = ~np.isnan(params[:, 0])
+    thicknesses = params[ok, 0]
+    s_surfaces = params[ok, 1]
     
     return {
         'thickness_mean': np.mean(thicknesses),
@@ -198,5 +227,6 @@ def monte_carlo_uncertainty(energies, s_exp, s_err, n_iterations=1000):
         'thickness_values': thicknesses,
         's_surface_mean': np.mean(s_surfaces),
         's_surface_std': np.std(s_surfaces),
-        's_surface_values': s_surfaces
+        's_surface_values': s_surfaces,
+        'n_failed': int(np.count_nonzero(~ok))
     }
\ No newline at end of file
@@ -7,9 +7,10 @@ RHO_OXIDE = 5.24      # Fe2O3 density (g/cm³)
 RHO_STEEL = 8.00      # SS316L density (g/cm³)
 
 # Makhov parameters (from your code: n, m, A = 1.6, 2.0, 4.0)
-MAKHOV_A = 40.0
+MAKHOV_A = 4.0         # microgram cm^-2 keV^-N
 MAKHOV_N = 1.6
 MAKHOV_M = 2.0
+MAKHOV_GAMMA = 0.886   # Gamma(1 + 1/m) for m = 2
 
 # S-parameters
 S_BULK_STEEL = 0.52
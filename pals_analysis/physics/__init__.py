@@ -1,7 +1,8 @@
 """Physics module."""
 
+from .layers import Layers, as_layers
 from .implantation import makhov_profile, energy_to_mean_depth, get_graded_density
-from .annihilation import calculate_annihilation_profile
+from .annihilation import DiffusionSolver, calculate_annihilation_profile
 
-__all__ = ['makhov_profile', 'energy_to_mean_depth', 'get_graded_density', 
-           'calculate_annihilation_profile']
\ No newline at end of file
+__all__ = ['Layers', 'as_layers', 'makhov_profile', 'energy_to_mean_depth', 'get_graded_density', 
+           'DiffusionSolver', 'calculate_annihilation_profile']
\ No newline at end of file
@@ -1,77 +1,160 @@
-import numpy as np
-
-
 """Implantation functions """
 
 import numpy as np
+from scipy.special import expit
 
-def makhov_profile(z_grid, energy_kev, layers, model='sharp', w=10.0):
+from ..config import MAKHOV_A, MAKHOV_GAMMA, MAKHOV_M, MAKHOV_N
+from .._numba import HAVE_NUMBA, jit_kernel, prange
+from .layers import as_layers
+
+
+@jit_kernel
+def _makhov_kernel(z_grid, densities, xi, energies, A, N, gamma_m):
     """
-    Calculates Implantation Profile P(z).
-    This is based on the Makhov profile and adapted here to multiple layers.
+    Makhov P(z) for every energy, shape (n_E, n_z), normalized per row.
+
+    The density and mass-depth maps are shared by all energies; each energy
+    is a single scalar loop over z, fusing the whole Makhov expression
+    without temporaries. Also returns the integrals before normalization,
+    so the caller can warn on non-positive ones. m = 2 (positrons), so the
+    Makhov powers are plain products; gamma_m is Gamma(1 + 1/m).
     """
+    n_z = xi.shape[0]
+    n_E = energies.shape[0]
 
-    # Basic parameters for Makhov Model. 2 is for positrons
-    N, m, A = 1.6, 2.0, 4.0
-    
-    # Generates appropriate arrays.
+    p_z = np.empty((n_E, n_z))
+    integrals = np.empty(n_E)
+    for i in prange(n_E):
+        xi_0 = A * max(energies[i], 0.01)**N / gamma_m
+        pre = 2.0 / xi_0
+        row = p_z[i]
+        total = 0.0
+        for j in range(n_z):
+            r = xi[j] / xi_0
+            row[j] = pre * r * np.exp(-r * r) * densities[j]
+            # Trapezoid rule
+            if j > 0:
+                total += 0.5 * (row[j - 1] + row[j]) * (z_grid[j] - z_grid[j - 1])
+        integrals[i] = total
+        if total > 0:
+            inv_total = 1.0 / total
+            for j in range(n_z):
+                row[j] *= inv_total
+    return p_z, integrals
+
+
+def build_density_xi(z_grid, layers, model='sharp', w=10.0):
+    """
+    Density map and mass depth xi on the z-grid, shared by all energies.
+    layers must be a Layers instance.
+    """
     z_grid = np.asarray(z_grid)
-    densities = np.zeros_like(z_grid)
-    
+
     # 1. Build Density Map
     if model == 'graded' and len(layers) >= 2:
         # Graded: Sigmoid transition between Layer 0 and Layer 1
         # NEEDS ADJUSTMENT FOR MORE LAYERS!
-        d_ox = layers[0]['thickness']
-        rho_ox = layers[0]['density']
-        rho_sub = layers[1]['density']
+        d_ox = layers.thickness[0]
+        rho_ox = layers.density[0]
+        rho_sub = layers.density[1]
         
         # Sigmoid function centered at d_ox with width w
         # The factor 4 ensures 'w' represents roughly the 12%-88% transition width
-        # of the sigmoid function.
-        densities = rho_ox + (rho_sub - rho_ox) / (1 + np.exp(-(z_grid - d_ox) / (w/4.0)))
+        # of the sigmoid function. expit(x) = 1 / (1 + exp(-x)), without
+        # overflowing far away from the interface.
+        densities = rho_ox + (rho_sub - rho_ox) * expit((z_grid - d_ox) * (4.0 / w))
     else:
         # Step function density profile.
-        # We go through each layer by saying "everything is this layer is this
-        # density" and then we move on to the next layer.
+        # Every point of the grid gets the density of the layer it is in.
         # This function supports >2 layers.
-        curr_z = 0
-        for l in layers:
-            mask = (z_grid >= curr_z) & (z_grid <= curr_z + l['thickness'])
-            densities[mask] = l['density']
-            curr_z += l['thickness']
+        densities = layers.step_map(layers.density, z_grid)
 
     # 2. Calculate Mass Depth (Cumulative Density)
     # We integrate density * dz to get depth in g/cm^2
-    dz = z_grid[1] - z_grid[0]
+    # dz is the spacing to the previous point (the first point takes the
+    # first spacing), so non-uniform grids work too.
+    dz = np.diff(z_grid, prepend=2 * z_grid[0] - z_grid[1])
     # np.cumsum is fast and works for dense grids.
 
     # This results in the mass depth.
     xi = np.cumsum(densities * dz) * 0.1 
      # 0.1 conversion factor so that resulting mass in units mu g /cm^2. 
-    
+    return densities, xi
+
+
+def makhov_from_xi(z_grid, densities, xi, energy_kev):
+    """
+    Normalized Makhov profile P(z) from prebuilt density and mass-depth
+    maps (see build_density_xi), with the shape rules of makhov_profile.
+    """
+    # Basic parameters for Makhov Model (config). m = 2 is for positrons
+    N, m, A = MAKHOV_N, MAKHOV_M, MAKHOV_A
+
     # 3. Calculate Makhov Profile
+    if HAVE_NUMBA and m == 2:
+        # Compiled kernel (m = 2 only); same physics as the NumPy path below.
+        energies = np.asarray(energy_kev, dtype=np.float64)
+        p_z, integral = _makhov_kernel(
+            np.ascontiguousarray(z_grid, dtype=np.float64),
+            np.ascontiguousarray(densities, dtype=np.float64),
+            np.ascontiguousarray(xi, dtype=np.float64),
+            np.ascontiguousarray(energies.reshape(-1)), A, N, MAKHOV_GAMMA,
+        )
+        if np.any(integral <= 0):
+            print("Warning: Makhov profile integral is non-positive, check parameters.")
+        return p_z.reshape(energies.shape + xi.shape)
+
     # Ensure energy is not zero to avoid division errors
-    eff_E = np.maximum(energy_kev, 0.01)
+    eff_E = np.maximum(np.asarray(energy_kev, dtype=float), 0.01)
 
-    # We convert z_0 to xi_0 which is similar to a mass distribution,
-    xi_0 = (A * eff_E**N) / 0.886
+    # We convert z_0 to xi_0 which is similar to a mass distribution.
+    # The trailing axis lets every energy broadcast against the whole z-grid.
+    xi_0 = (A * eff_E[..., None]**N) / MAKHOV_GAMMA
     
     # The Makhov formula P(z) = dP/dz
-    p_xi = (m * xi**(m-1) / xi_0**m) * np.exp(-(xi/xi_0)**m)
+    #   P(xi) = m * xi**(m-1) / xi_0**m * exp(-(xi/xi_0)**m)
+    #         = (m / xi_0) * r**(m-1) * exp(-r**m),   r = xi / xi_0
+    # evaluated in place so only two (n_E, n_z) arrays are allocated.
+    r = xi / xi_0
+    p_z = r**(m-1)
+    np.power(r, m, out=r)
+    np.negative(r, out=r)
+    np.exp(r, out=r)
+    p_z *= r
+    p_z *= m / xi_0
     
     # Convert P(mass) to P(z) by multiplying by density (Jacobian)
     # P(z) d(z) = P(xi) d(xi), so P(z) = P(xi) * d(xi)/d(z) = P(xi) * densities
-    p_z = p_xi * densities
+    p_z *= densities
     
-    # Normalize
-    integral = np.trapezoid(p_z, z_grid)
+    # Normalize (one integral per energy)
+    integral = np.trapezoid(p_z, z_grid, axis=-1)
 
-    if integral <= 0:
+    if np.any(integral <= 0):
         print("Warning: Makhov profile integral is non-positive, check parameters.")
     
     # Returns Makhov profile
-    return p_z / integral if integral > 0 else p_z
+    integral = np.where(integral > 0, integral, 1.0)
+    p_z /= integral[..., None]
+    return p_z
+
+
+def makhov_profile(z_grid, energy_kev, layers, model='sharp', w=10.0):
+    """
+    Calculates Implantation Profile P(z).
+    This is based on the Makhov profile and adapted here to multiple layers.
+
+    energy_kev may be a float, giving P(z) with shape (n_z,), or a 1-D array
+    of energies, giving one profile per row with shape (n_E, n_z).
+    layers is a Layers instance or a list of layer dicts.
+    """
+    z_grid = np.asarray(z_grid)
+    layers = as_layers(layers)
+
+    # The density and mass-depth maps do not depend on the energy, so they
+    # are built once for all energies.
+    densities, xi = build_density_xi(z_grid, layers, model=model, w=w)
+    return makhov_from_xi(z_grid, densities, xi, energy_kev)
 
 
 def energy_to_mean_depth(energies, d_ox, rho_ox, rho_sub):
@@ -82,25 +165,22 @@ def energy_to_mean_depth(energies, d_ox, rho_ox, rho_sub):
     NEEDS ADJUSTMENT FOR MORE LAYERS!
 
     """
-    A, N = 4.0, 1.6
-    mean_depths = []
-    
-    for E in energies:
-        mass_capacity = A * (E**N)
-        # Again convert to avoid issues with units. It makes it easier
-        # to correct apply the mean depth equation for each energy and in
-        # each layer.
-        d_ox_micro = rho_ox * d_ox * 0.1
-        
-        if mass_capacity <= d_ox_micro:
-            z_bar = mass_capacity / (rho_ox * 0.1)
-        else:
-            remaining_mass = mass_capacity - d_ox_micro
-            z_bar = d_ox + remaining_mass / (rho_sub * 0.1)
-        
-        mean_depths.append(z_bar)
-    
-    return np.array(mean_depths)
+    A, N = MAKHOV_A, MAKHOV_N
+    energies = np.asarray(energies, dtype=np.float64)
+
+    mass_capacity = A * (energies**N)
+    # Again convert to avoid issues with units. It makes it easier
+    # to correct apply the mean depth equation for each energy and in
+    # each layer.
+    d_ox_micro = rho_ox * d_ox * 0.1
+
+    # Energies that stop inside the oxide, or in the substrate after
+    # crossing the whole oxide mass (all energies at once).
+    return np.where(
+        mass_capacity <= d_ox_micro,
+        mass_capacity / (rho_ox * 0.1),
+        d_ox + (mass_capacity - d_ox_micro) / (rho_sub * 0.1),
+    )
 
 
 def get_graded_density(z, d_ox, w, rho_ox, rho_sub):
@@ -108,4 +188,4 @@ def get_graded_density(z, d_ox, w, rho_ox, rho_sub):
     This function returns a graded density profile using a sigmoid function.
     NEEDS ADJUSTMENT FOR MORE LAYERS!
     """
-    return rho_ox + (rho_sub - rho_ox) / (1 + np.exp(-(z - d_ox) / (w/4)))
\ No newline at end of file
+    return rho_ox + (rho_sub - rho_ox) * expit((z - d_ox) * (4.0 / w))
\ No newline at end of file
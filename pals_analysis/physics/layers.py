@@ -0,0 +1,73 @@
+"""Layer stack stored as arrays (one entry per layer)."""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(eq=False, frozen=True)
+class Layers:
+    """
+    Layer stack from the surface down, as contiguous float64 arrays.
+
+    Same content as the list of dicts used in the notebooks,
+    [{'thickness': ..., 'density': ..., 'L_diff': ...}, ...], but each
+    property is one array so it can be indexed without dict lookups.
+    Instances are immutable (the arrays are read-only); derive variants with
+    dataclasses.replace.
+
+    - thickness : nm
+    - density : g/cm^3
+    - L_diff : nm, NaN where unknown (only the diffusion solve needs it)
+    """
+    thickness: np.ndarray
+    density: np.ndarray
+    L_diff: np.ndarray
+
+    def __post_init__(self):
+        for name in ('thickness', 'density', 'L_diff'):
+            # Own copy, so freezing it never touches the caller's array.
+            values = np.array(getattr(self, name), dtype=np.float64)
+            values.setflags(write=False)
+            object.__setattr__(self, name, values)
+
+    @classmethod
+    def from_dicts(cls, dlist):
+        """
+        Builds Layers from a list of layer dicts (extra keys are ignored).
+        'L_diff' is optional, implantation-only stacks leave it out and get
+        NaN.
+        """
+        return cls(
+            thickness=[l['thickness'] for l in dlist],
+            density=[l['density'] for l in dlist],
+            L_diff=[l.get('L_diff', np.nan) for l in dlist],
+        )
+
+    def __len__(self):
+        return len(self.thickness)
+
+    def step_map(self, values, z_grid):
+        """
+        Per-layer values (e.g. self.density) as a step function on the
+        sorted depth grid z_grid (nm).
+
+        A point on an interface belongs to the deeper layer, the bottom of
+        the stack to the last layer, and points outside the stack are 0.
+        """
+        z_grid = np.asarray(z_grid, dtype=np.float64)
+        edges = np.cumsum(self.thickness)
+
+        # Index of the layer holding each point, from the interfaces
+        # (one binary search per point, no mask per layer).
+        idx = np.searchsorted(edges, z_grid, side='right')
+        idx[z_grid == edges[-1]] = len(self) - 1
+        idx[z_grid < 0] = len(self)
+
+        # Index len(self) (outside the stack) reads the trailing 0.
+        return np.append(np.asarray(values, dtype=np.float64), 0.0)[idx]
+
+
+def as_layers(layers):
+    """Returns layers as a Layers instance, converting a list of dicts."""
+    return layers if isinstance(layers, Layers) else Layers.from_dicts(layers)
@@ -19,7 +19,8 @@ def setup_plot_style():
     })
 
 
-def plot_s_parameter_fit(energies, s_exp, d_ox, s_surf, save_as=None):
+def plot_s_parameter_fit(energies, s_exp, d_ox, s_surf, save_as=None,
+                         s_fit=None, residuals=None):
     """
     Plot S-parameter data with fit.
     
@@ -35,14 +36,19 @@ def plot_s_parameter_fit(energies, s_exp, d_ox, s_surf, save_as=None):
         Fitted surface S-parameter
     save_as : str, optional
         Filename to save figure
+    s_fit : array, optional
+        Fitted S-curve at energies, if the caller already has it;
+        computed from d_ox and s_surf otherwise
+    residuals : array, optional
+        s_exp - s_fit, if already computed
     """
-    from ..analysis.thickness_solver import fit_model
-    
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 8), 
                                     gridspec_kw={'height_ratios': [3, 1]})
     
     # Main plot
-    s_fit = fit_model(energies, d_ox, s_surf)
+    if s_fit is None:
+        from ..analysis.thickness_solver import theoretical_S_curve
+        s_fit = theoretical_S_curve(np.asarray(energies, dtype=float), d_ox, s_surf)
     ax1.scatter(energies, s_exp, color='red', s=50, zorder=3, label='Experimental Data')
     ax1.plot(energies, s_fit, 'b-', linewidth=2, label=f'Fit: d={d_ox:.1f}nm, S={s_surf:.4f}')
     ax1.axhline(0.52, color='gray', linestyle='--', alpha=0.5, label='Bulk Steel')
@@ -52,7 +58,8 @@ def plot_s_parameter_fit(energies, s_exp, d_ox, s_surf, save_as=None):
     ax1.set_title('S-Parameter vs Energy', fontsize=14, fontweight='bold')
     
     # Residual plot
-    residuals = s_exp - s_fit
+    if residuals is None:
+        residuals = s_exp - s_fit
     ax2.scatter(energies, residuals, color='purple', s=40, alpha=0.7)
     ax2.axhline(0, color='black', linestyle='-', linewidth=1)
     ax2.set_xlabel('Energy (keV)', fontsize=12, fontweight='bold')
@@ -217,14 +224,17 @@ def plot_fit_result(energies, s_exp, s_err, d_fit, w_fit, s_surf_fit):
     
     # Run the simulation using the FITTED parameters
     # Note: We fix s_bulk=0.520 as we did in the solver
-    s_fit_curve = numerical_S_curve(
-        E_smooth, 
+    # The smooth curve and the model at the experimental energies (for the
+    # residuals below) are simulated together in one batched call.
+    s_all = numerical_S_curve(
+        np.concatenate([E_smooth, np.asarray(energies, dtype=float)]),
         d_ox=d_fit, 
         w=w_fit, 
         s_surf=s_surf_fit, 
         s_bulk=0.520, 
         model='graded'
     )
+    s_fit_curve, s_model_at_points = s_all[:len(E_smooth)], s_all[len(E_smooth):]
     
     # 2. Plotting
     plt.figure(figsize=(8, 6))
@@ -246,7 +256,6 @@ def plot_fit_result(energies, s_exp, s_err, d_fit, w_fit, s_surf_fit):
     
     # Optional: Residuals plot (Difference between model and data)
     # To do this, we need model points exactly at the experimental energies
-    s_model_at_points = numerical_S_curve(energies, d_fit, w_fit, s_surf_fit, 0.520, 'graded')
     residuals = s_exp - s_model_at_points
     
     # Inset for residuals? Or just print chi-squared?
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from pals_analysis.physics import Layers, makhov_profile
+from pals_analysis.physics.annihilation import DiffusionSolver
+
+
+IMPLANTATION_ONLY = [
+    {'thickness': 60, 'density': 5.22},
+    {'thickness': 1000, 'density': 8.0},
+]
+
+
+def test_from_dicts_without_L_diff():
+    layers = Layers.from_dicts(IMPLANTATION_ONLY)
+    assert np.isnan(layers.L_diff).all()
+
+
+def test_makhov_profile_without_L_diff():
+    z = np.linspace(0, 1000, 1000)
+    with_L = [dict(layer, L_diff=30.0) for layer in IMPLANTATION_ONLY]
+    p_z = makhov_profile(z, 5.0, IMPLANTATION_ONLY)
+    assert np.all(np.isfinite(p_z))
+    np.testing.assert_array_equal(p_z, makhov_profile(z, 5.0, with_L))
+
+
+def test_diffusion_requires_L_diff():
+    solver = DiffusionSolver(np.linspace(0, 1000, 1000))
+    with pytest.raises(ValueError):
+        solver.L_grid(IMPLANTATION_ONLY)